@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from pathlib import Path
-import textwrap
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import re
@@ -10,7 +10,7 @@ import yfinance as yf
 import requests
 import plotly.graph_objects as go
 
-from get_news import run_news_crawl
+from get_news import run_news_crawl, migrate_csv_to_parquet, SESSION, DATA_FILE, NEWS_COLUMNS
 
 # --- 页面配置 ---
 st.set_page_config(
@@ -20,8 +20,12 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# --- 数据文件路径 ---
-DATA_FILE = Path("data") / "news_data.csv"
+# --- 新闻卡片模板 ---
+CARD_TMPL = (
+    '<div class="card"><div class="sentiment-badge {cls}">{txt}</div>'
+    '<div class="news-title">{title}</div><div class="news-summary">{summary}</div>'
+    '<div class="news-meta"><span>{t}</span><a href="{url}" target="_blank">阅读原文 &rarr;</a></div></div>'
+)
 
 # --- 自定义 CSS ---
 st.markdown("""
@@ -65,7 +69,7 @@ def get_comex_gold_from_sina():
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36',
             'Referer': 'http://finance.sina.com.cn/'
         }
-        response = requests.get("http://hq.sinajs.cn/list=hf_GC", headers=headers, timeout=5)
+        response = SESSION.get("http://hq.sinajs.cn/list=hf_GC", headers=headers, timeout=5)
         response.raise_for_status()
         price_str = response.text.split(',')[1]
         return float(price_str)
@@ -73,34 +77,48 @@ def get_comex_gold_from_sina():
         print(f"从新浪财经获取COMEX黄金价格失败: {e}")
         return None
 
+_TICKER_CACHE = {}
+
+def get_ticker(symbol):
+    # 复用 yf.Ticker 实例，避免备用路径反复创建
+    if symbol not in _TICKER_CACHE:
+        _TICKER_CACHE[symbol] = yf.Ticker(symbol)
+    return _TICKER_CACHE[symbol]
+
 @st.cache_data(ttl=900)
 def get_market_data():
-    gold_price = cny_rate = None
     gold_price = get_comex_gold_from_sina()
-    if gold_price is None:
-        try:
-            gold_ticker = yf.Ticker("GC=F")
-            data = gold_ticker.history(period="1d", interval="1m")
-            if not data.empty:
-                gold_price = data['Close'].iloc[-1]
-        except Exception as e:
-            print(f"备用源 yfinance (GC=F) 也失败了: {e}")
+    # 新浪失败时才需要从 yfinance 获取黄金价格，汇率与其合并为一次批量请求
+    symbols = ["CNY=X"] if gold_price is not None else ["GC=F", "CNY=X"]
+    closes = {}
     try:
-        cny_ticker = yf.Ticker("CNY=X")
-        data = cny_ticker.history(period="1d", interval="1m")
+        data = yf.download(symbols, period="1d", interval="1m", progress=False, threads=True)
         if not data.empty:
-            cny_rate = data['Close'].iloc[-1]
+            closes = {symbol: data['Close'][symbol].dropna() for symbol in symbols}
     except Exception as e:
-        print(f"未能获取美元汇率 (CNY=X): {e}")
+        print(f"批量获取 yfinance 行情失败: {e}")
+    for symbol in symbols:
+        close = closes.get(symbol)
+        if close is None or close.empty:
+            try:
+                close = get_ticker(symbol).history(period="1d", interval="1m")['Close']
+            except Exception as e:
+                print(f"未能从 yfinance 获取 {symbol}: {e}")
+                continue
+        if not close.empty:
+            closes[symbol] = close
+    if gold_price is None and "GC=F" in closes and not closes["GC=F"].empty:
+        gold_price = closes["GC=F"].iloc[-1]
+    cny_rate = closes["CNY=X"].iloc[-1] if "CNY=X" in closes and not closes["CNY=X"].empty else None
     return gold_price, cny_rate
 
-@st.cache_data(ttl=3600)
-def get_historical_data(days=90):
+# 持久化缓存不支持 TTL，改由 as_of (精确到小时) 作为缓存键的一部分来控制过期
+@st.cache_data(persist="disk", max_entries=4)
+def get_historical_data(days=90, as_of=None):
     try:
-        tickers = yf.Tickers('GC=F CNY=X')
-        hist = tickers.history(period=f"{days}d", auto_adjust=False)
-        df = hist['Close'].copy()
-        df.columns = ['COMEX_Gold', 'USD_CNY']
+        hist = yf.download(["GC=F", "CNY=X"], period=f"{days}d", auto_adjust=False, progress=False, threads=True)
+        # 多代码下载的列按字母排序，需按代码名取列而不是按位置重命名
+        df = hist['Close'][['GC=F', 'CNY=X']].rename(columns={'GC=F': 'COMEX_Gold', 'CNY=X': 'USD_CNY'})
         df.ffill(inplace=True)
         df.dropna(inplace=True)
         df['Theoretical_Price'] = (df['COMEX_Gold'] / 31.1035) * df['USD_CNY']
@@ -126,32 +144,30 @@ def create_sentiment_charts(df):
         marker_colors=['#28a745','#dc3545','#6c757d']
     )])
     pie_fig.update_layout(title_text='新闻情绪分布', template='plotly_dark', showlegend=False, margin=dict(l=20, r=20, t=40, b=20))
-    daily_sentiment = df.groupby(df['time'].dt.date)['sentiment'].mean().reset_index()
+    daily_sentiment = df.groupby(df['time'].dt.floor('D'), sort=True)['sentiment'].mean().reset_index(name='sentiment')
     bar_fig = go.Figure()
     bar_fig.add_trace(go.Bar(
         x=daily_sentiment['time'],
         y=daily_sentiment['sentiment'],
-        marker_color=daily_sentiment['sentiment'].apply(lambda s: '#28a745' if s > 0.6 else ('#dc3545' if s < 0.4 else '#6c757d'))
+        marker_color=np.select([daily_sentiment['sentiment'] > 0.6, daily_sentiment['sentiment'] < 0.4], ['#28a745', '#dc3545'], default='#6c757d')
     ))
     bar_fig.update_layout(title_text='每日平均情绪趋势', template='plotly_dark', showlegend=False, margin=dict(l=20, r=20, t=40, b=20))
     bar_fig.add_hline(y=0.5, line_width=1, line_dash="dash", line_color="gray")
     return pie_fig, bar_fig
 
-@st.cache_data(ttl=600)
-def load_data(filepath: Path) -> pd.DataFrame:
+# 以数据目录的修改时间作为缓存键，新数据写入后自动失效
+@st.cache_data(persist="disk", max_entries=8)
+def load_data(filepath: Path, data_version: float | None = None) -> pd.DataFrame:
+    migrate_csv_to_parquet(filepath=filepath)
     if not filepath.exists():
         return pd.DataFrame()
     try:
-        df = pd.read_csv(filepath)
-        df['time'] = pd.to_datetime(df['time'])
+        df = pd.read_parquet(filepath, engine="pyarrow", columns=NEWS_COLUMNS)
         df.dropna(subset=['title', 'summary', 'url', 'time'], inplace=True)
         df.drop_duplicates(subset=['url'], inplace=True)
         if 'sentiment' in df.columns:
-            def categorize(score):
-                if score > 0.6: return "利好"
-                if score < 0.4: return "利空"
-                return "中性"
-            df['sentiment_category'] = df['sentiment'].apply(categorize)
+            cats = np.select([df['sentiment'] > 0.6, df['sentiment'] < 0.4], ["利好", "利空"], default="中性")
+            df['sentiment_category'] = pd.Categorical(cats, categories=["利好", "利空", "中性"])
         return df
     except Exception as e:
         st.error(f"加载新闻数据时出错: {e}")
@@ -189,12 +205,12 @@ with col3:
     st.metric(label="COMEX人民币换算价", value=f"¥{theoretical_price:.2f}" if theoretical_price else "N/A", help="公式: (COMEX价 / 31.1035) * 汇率")
 st.markdown("---_---")
 
-hist_df = get_historical_data()
+hist_df = get_historical_data(as_of=datetime.now().strftime('%Y-%m-%d %H'))
 if not hist_df.empty:
     fig = create_price_chart(hist_df)
     st.plotly_chart(fig, use_container_width=True)
 
-df = load_data(DATA_FILE)
+df = load_data(DATA_FILE, DATA_FILE.stat().st_mtime if DATA_FILE.exists() else None)
 
 if not df.empty and 'sentiment' in df.columns:
     st.markdown("### 市场情绪仪表盘")
@@ -208,7 +224,7 @@ if not df.empty and 'sentiment' in df.columns:
 st.markdown("### 财经新闻速递")
 
 if df.empty:
-    st.warning("数据文件 (data/news_data.csv) 不存在或为空。请先运行 `get_news.py` 脚本来获取数据。")
+    st.warning(f"数据文件 ({DATA_FILE}) 不存在或为空。请先运行 `get_news.py` 脚本来获取数据。")
 else:
     sentiment_options = {"全部": "all", "利好": "bullish", "利空": "bearish", "中性": "neutral"}
     selected_sentiment = st.sidebar.selectbox("按情绪筛选", options=list(sentiment_options.keys()))
@@ -224,33 +240,47 @@ else:
         start_date = st.sidebar.date_input("开始日期", value=actual_min_date, min_value=picker_min_date, max_value=picker_max_date)
         end_date = st.sidebar.date_input("结束日期", value=actual_max_date, min_value=picker_min_date, max_value=picker_max_date)
     
-    filtered_df = df.copy()
-    if selected_keywords:
-        keyword_mask = filtered_df.apply(lambda row: any(kw in str(row['title']) or kw in str(row['summary']) for kw in selected_keywords), axis=1)
-        filtered_df = filtered_df[keyword_mask]
+    # 关键词、日期与情绪条件合并为一个布尔掩码，只做一次索引
+    mask = np.ones(len(df), dtype=bool)
+    # 全选时无需过滤 (抓取阶段已保证每条新闻至少命中一个关键词)
+    if selected_keywords and set(selected_keywords) != set(all_keywords):
+        pattern = "|".join(map(re.escape, selected_keywords))
+        haystack = df['title'].fillna("") + " " + df['summary'].fillna("")
+        mask &= haystack.str.contains(pattern, regex=True, na=False).to_numpy(dtype=bool)
     if start_date and end_date:
-        filtered_df = filtered_df[(filtered_df['time'].dt.date >= start_date) & (filtered_df['time'].dt.date <= end_date)]
-    
-    if 'sentiment_category' in filtered_df.columns and selected_sentiment != "全部":
-        filtered_df = filtered_df[filtered_df['sentiment_category'] == selected_sentiment]
+        start_ts = pd.Timestamp(start_date)
+        end_ts = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(nanoseconds=1)
+        mask &= df['time'].between(start_ts, end_ts).to_numpy()
+    if 'sentiment_category' in df.columns and selected_sentiment != "全部":
+        mask &= (df['sentiment_category'] == selected_sentiment).to_numpy()
+    filtered_df = df[mask]
 
     st.subheader(f"共找到 {len(filtered_df)} 条相关新闻")
     
     filtered_df = filtered_df.sort_values(by='time', ascending=False)
-    for _, row in filtered_df.iterrows():
-        sentiment_class = row.get('sentiment_category', "中性").replace("利好", "bullish").replace("利空", "bearish").replace("中性", "neutral")
-        sentiment_text = f"🐂 利好" if sentiment_class == "bullish" else (f"🐻 利空" if sentiment_class == "bearish" else f"😐 中性")
-
-        st.markdown(f'''
-        <div class="card">
-            <div class="sentiment-badge {sentiment_class}">{sentiment_text}</div>
-            <div class="news-title">{row["title"]}</div>
-            <div class="news-summary">{textwrap.shorten(row["summary"], width=250, placeholder="...")}</div>
-            <div class="news-meta">
-                <span>{row['time'].strftime('%Y-%m-%d %H:%M')}</span>
-                <a href="{row['url']}" target="_blank">阅读原文 &rarr;</a>
-            </div>
-        </div>
-        ''', unsafe_allow_html=True)
+    # 只渲染当前页，前端负载不随历史数据增长
+    page_size = st.sidebar.selectbox("每页条数", [20, 50, 100], index=0)
+    page_count = max(1, -(-len(filtered_df) // page_size))
+    page = st.sidebar.number_input("页码", min_value=1, max_value=page_count, value=1, step=1)
+    view = filtered_df.iloc[(page - 1) * page_size : page * page_size]
+    st.caption(f"第 {page} / {page_count} 页")
+    # 先按列向量化生成卡片所需字段，再一次性拼接成单个 HTML 发送给前端
+    sentiment_class = view['sentiment_category'].map({"利好": "bullish", "利空": "bearish", "中性": "neutral"})
+    summary_short = view['summary'].where(view['summary'].str.len() <= 250, view['summary'].str.slice(0, 247).str.rstrip() + "...")
+    # 新闻内容来自外部网站，插入 HTML 前统一转义
+    cards_df = view.assign(
+        sentiment_class=sentiment_class,
+        sentiment_text=sentiment_class.map({"bullish": "🐂 利好", "bearish": "🐻 利空", "neutral": "😐 中性"}),
+        time_str=view['time'].dt.strftime('%Y-%m-%d %H:%M'),
+        title_html=view['title'].map(html.escape),
+        summary_html=summary_short.map(html.escape),
+        url_html=view['url'].map(html.escape),
+    )
+    cards_html = "\n".join(
+        CARD_TMPL.format(cls=row.sentiment_class, txt=row.sentiment_text, title=row.title_html,
+                         summary=row.summary_html, t=row.time_str, url=row.url_html)
+        for row in cards_df.itertuples(index=False)
+    )
+    st.markdown(cards_html, unsafe_allow_html=True)
     with st.expander("显示/隐藏原始数据表格"):
         st.dataframe(filtered_df, use_container_width=True)
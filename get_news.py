@@ -1,22 +1,49 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 from bs4.element import Tag
 from fake_useragent import UserAgent
 from datetime import datetime, timedelta
-import time
+from concurrent.futures import ThreadPoolExecutor
 import os
-import csv
+import pandas as pd
 from pathlib import Path
 import re
 import html
+import hashlib
+import sqlite3
+from functools import lru_cache
+from contextlib import closing
+import pyarrow as pa
+import pyarrow.parquet as pq
 from snownlp import SnowNLP
 
 # --- 常量定义 ---
 KEYWORDS = ["沪金", "黄金期货", "COMEX黄金", "实物黄金", "黄金ETF", "美联储", "利率"]
+KEYWORD_RE = re.compile("|".join(map(re.escape, KEYWORDS)))
 URL_TEMPLATE = "https://search.sina.com.cn/?q={keyword}&range=all&c=news&sort=time&page={page}"
 DATA_DIR = Path("data")
-DATA_FILE = DATA_DIR / "news_data.csv"
+# 新闻以 Parquet 数据集目录存储，每次抓取追加一个分片文件
+DATA_FILE = DATA_DIR / "news_data.parquet"
+LEGACY_CSV_FILE = DATA_DIR / "news_data.csv"
+# 已保存新闻的 URL 集合 (每行一个)，用于增量去重
+URLS_FILE = DATA_DIR / "urls.set"
+SENTIMENT_CACHE_FILE = DATA_DIR / "sentiment_cache.db"
+NEWS_COLUMNS = ["time", "title", "summary", "url", "sentiment"]
+NEWS_SCHEMA = pa.schema([
+    ("time", pa.timestamp("ns")),
+    ("title", pa.string()),
+    ("summary", pa.string()),
+    ("url", pa.string()),
+    ("sentiment", pa.float32()),
+])
 CRAWL_INTERVAL_HOURS = 4
+CRAWL_PAGES = 2
+CRAWL_WORKERS = 8
+# 只解析搜索结果块，跳过页面其余 DOM。
+# parse_only 阶段 class_ 会与整个 class 属性比较，而新浪的结果块是 "box-result clearfix"，需按类名单词匹配
+RESULT_STRAINER = SoupStrainer("div", class_=re.compile(r"(?:^|\s)box-result(?:\s|$)"))
 
 # --- 请求头设置 ---
 ua = UserAgent()
@@ -24,21 +51,34 @@ headers = {
     "User-Agent": ua.random
 }
 
+# --- 复用连接池的全局会话 ---
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+)
+# 重试只用于 https 的新闻抓取；http 的实时报价 (hq.sinajs.cn) 阻塞页面渲染，失败即放弃
+SESSION.mount("https://", _adapter)
+SESSION.headers.update(headers)
+
 # --- 数据清洗与解析 ---
 
+# 只匹配真正的标签，保留正文中的字面量 < 和 > (如 "金价<2000")
+_TAG_RE = re.compile(r'</?[A-Za-z][^>]*>')
+_CTRL_RE = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+_WS_RE = re.compile(r'\s+')
+
 def ultimate_clean_text(raw_html: str) -> str:
     if not isinstance(raw_html, str):
         return ""
-    text = raw_html
-    while True:
-        unescaped = html.unescape(text)
-        if unescaped == text:
-            break
-        text = unescaped
-    text = BeautifulSoup(text, "html.parser").get_text(strip=True)
-    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+    text = html.unescape(raw_html)
+    # 偶尔会遇到二次转义的实体 (如 &amp;lt;)，最多再解一次
+    if "&" in text:
+        text = html.unescape(text)
+    text = _TAG_RE.sub('', text)
+    text = _CTRL_RE.sub('', text)
+    return _WS_RE.sub(' ', text).strip()
 
 def parse_sina_time(time_str: str) -> datetime:
     if not isinstance(time_str, str):
@@ -59,81 +99,159 @@ def parse_sina_time(time_str: str) -> datetime:
     except (ValueError, AttributeError):
         return now
 
+@lru_cache(maxsize=4096)
 def get_sentiment_score(text: str) -> float:
     if not text:
         return 0.5
     return SnowNLP(text).sentiments
 
+def _text_key(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+def score_sentiments(texts: list[str], cache_file: Path = SENTIMENT_CACHE_FILE) -> list[float]:
+    """批量计算情绪分数，命中磁盘缓存的文本不再调用 SnowNLP。"""
+    keys = {text: _text_key(text) for text in texts}
+    cached = {}
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # sqlite3 连接的 with 只负责提交/回滚，不会关闭连接，需用 closing 显式关闭
+        with closing(sqlite3.connect(cache_file, timeout=30)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sentiment (key TEXT PRIMARY KEY, score REAL)")
+            unique_keys = list(set(keys.values()))
+            if unique_keys:
+                placeholders = ",".join("?" * len(unique_keys))
+                cached = dict(conn.execute(f"SELECT key, score FROM sentiment WHERE key IN ({placeholders})", unique_keys))
+            missing = {key: get_sentiment_score(text) for text, key in keys.items() if key not in cached}
+            if missing:
+                conn.executemany("INSERT OR REPLACE INTO sentiment (key, score) VALUES (?, ?)", missing.items())
+            cached.update(missing)
+    except sqlite3.Error as e:
+        print(f"情绪缓存 {cache_file} 不可用: {e}")
+        cached.update({key: get_sentiment_score(text) for text, key in keys.items() if key not in cached})
+    return [cached[keys[text]] for text in texts]
+
 # --- 核心功能函数 (已恢复到简洁版本) ---
-def fetch_news(keyword: str, pages: int = 2) -> list[dict]:
+def fetch_page(keyword: str, page: int) -> list[dict]:
     news_list = []
-    for page in range(1, pages + 1):
-        url = URL_TEMPLATE.format(keyword=keyword, page=page)
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, "html.parser")
-                results = soup.find_all("div", class_="box-result")
-                for item in results:
-                    if not isinstance(item, Tag):
-                        continue
-                    title_tag = item.find("h2")
-                    summary_tag = item.find("p", class_="content")
-                    time_tag = item.find("span", class_="fgray_time")
-                    
-                    title = ultimate_clean_text(title_tag.get_text() if title_tag else "")
-                    summary = ultimate_clean_text(summary_tag.get_text() if summary_tag else "")
-
-                    link_tag = None
-                    # 确保 title_tag 是一个有效的 Tag 对象，然后再在其中查找
-                    if isinstance(title_tag, Tag):
-                        link_tag = title_tag.find("a")
-                    
-                    # 同样，确保 link_tag 是有效的 Tag 对象，然后再获取 href 属性
-                    link = link_tag["href"] if isinstance(link_tag, Tag) else None
-                    pub_time_str = time_tag.get_text(strip=True) if time_tag else None
-
-                    # 只有当标题、摘要和发布时间都存在时，才处理该新闻
-                    if title and summary and pub_time_str:
+    candidates = []
+    url = URL_TEMPLATE.format(keyword=keyword, page=page)
+    try:
+        response = SESSION.get(url, timeout=10)
+        if response.status_code == 200:
+            soup = BeautifulSoup(response.content, "lxml", parse_only=RESULT_STRAINER)
+            results = soup.find_all("div", class_="box-result")
+            for item in results:
+                if not isinstance(item, Tag):
+                    continue
+                title_tag = item.find("h2")
+                summary_tag = item.find("p", class_="content")
+                time_tag = item.find("span", class_="fgray_time")
+                
+                title = ultimate_clean_text(title_tag.get_text() if title_tag else "")
+                summary = ultimate_clean_text(summary_tag.get_text() if summary_tag else "")
+
+                link_tag = None
+                # 确保 title_tag 是一个有效的 Tag 对象，然后再在其中查找
+                if isinstance(title_tag, Tag):
+                    link_tag = title_tag.find("a")
+                
+                # 同样，确保 link_tag 是有效的 Tag 对象，然后再获取 href 属性
+                link = link_tag["href"] if isinstance(link_tag, Tag) else None
+                pub_time_str = time_tag.get_text(strip=True) if time_tag else None
+
+                # 只有当标题、摘要和发布时间都存在，且命中关键词时，才处理该新闻
+                if title and summary and pub_time_str:
+                    content_to_check = title + summary
+                    if KEYWORD_RE.search(content_to_check):
                         parsed_time = parse_sina_time(pub_time_str)
-                        content_to_check = title + summary
-                        sentiment = get_sentiment_score(content_to_check)
-                        if any(kw in content_to_check for kw in KEYWORDS):
-                            news_list.append({"title": title, "summary": summary, "time": parsed_time.isoformat(), "url": link, "sentiment": sentiment})
-            time.sleep(1)
-        except requests.RequestException as e:
-            print(f"抓取页面 {url} 失败: {e}")
-        except Exception as e:
-            print(f"处理页面 {url} 时发生未知错误: {e}")
+                        candidates.append((content_to_check, {"title": title, "summary": summary, "time": parsed_time.isoformat(), "url": link}))
+            # 整页解析完成后再统一计算情绪分数，未命中关键词的新闻不参与打分
+            scores = score_sentiments([content for content, _ in candidates])
+            for (_, news), sentiment in zip(candidates, scores):
+                news["sentiment"] = sentiment
+                news_list.append(news)
+    except requests.RequestException as e:
+        print(f"抓取页面 {url} 失败: {e}")
+    except Exception as e:
+        print(f"处理页面 {url} 时发生未知错误: {e}")
     return news_list
 
-def save_news_to_csv(news_list: list[dict], filepath: Path) -> int:
-    filepath.parent.mkdir(exist_ok=True)
-    file_exists = filepath.exists()
+def _to_record(item: dict) -> dict | None:
+    try:
+        parsed_time = item["time"]
+        if isinstance(parsed_time, str):
+            parsed_time = datetime.fromisoformat(parsed_time)
+        sentiment = item.get("sentiment")
+        return {
+            "time": parsed_time,
+            "title": item.get("title"),
+            "summary": item.get("summary"),
+            "url": item.get("url"),
+            "sentiment": float(sentiment) if sentiment not in (None, "") else None,
+        }
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def load_existing_urls(filepath: Path, urls_file: Path) -> set[str]:
+    if not filepath.exists():
+        # 数据集被删除 (如手动重置) 时，URL 集合文件也随之清空
+        urls_file.unlink(missing_ok=True)
+        return set()
+    if urls_file.exists():
+        return set(urls_file.read_text(encoding='utf-8').splitlines())
+    # 首次使用 URL 集合文件时，从已有数据中重建
+    urls = [url for url in pq.read_table(filepath, columns=["url"]).column("url").to_pylist() if url]
+    urls_file.write_text("".join(f"{url}\n" for url in urls), encoding='utf-8')
+    return set(urls)
+
+def save_news(news_list: list[dict], filepath: Path, urls_file: Path = URLS_FILE) -> int:
     new_items_count = 0
     try:
-        fieldnames = ["time", "title", "summary", "url", "sentiment"]
-        with open(filepath, mode='a', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            existing_urls = set()
-            if file_exists:
-                with open(filepath, mode='r', newline='', encoding='utf-8-sig') as fr:
-                    reader = csv.DictReader(fr)
-                    for row in reader:
-                        if 'url' in row:
-                            existing_urls.add(row['url'])
-            new_items = [item for item in news_list if item.get('url') not in existing_urls]
-            if new_items:
-                writer.writerows(new_items)
-                new_items_count = len(new_items)
-    except IOError as e:
+        urls_file.parent.mkdir(parents=True, exist_ok=True)
+        existing_urls = load_existing_urls(filepath, urls_file)
+        new_items = [item for item in news_list if item.get('url') and item['url'] not in existing_urls]
+        records = [r for r in map(_to_record, new_items) if r is not None]
+        if records:
+            filepath.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pylist(records, schema=NEWS_SCHEMA)
+            part_file = filepath / f"part-{datetime.now().strftime('%Y%m%d%H%M%S%f')}.parquet"
+            pq.write_table(table, part_file)
+            with open(urls_file, mode='a', encoding='utf-8') as f:
+                f.writelines(f"{r['url']}\n" for r in records)
+            new_items_count = len(records)
+    except (IOError, pa.ArrowException) as e:
         print(f"无法写入文件 {filepath}: {e}")
     return new_items_count
 
+def migrate_csv_to_parquet(csv_path: Path = LEGACY_CSV_FILE, filepath: Path = DATA_FILE) -> int:
+    """将旧版 CSV 数据一次性迁移为 Parquet，已迁移或无旧数据时不做任何事。"""
+    if filepath.exists() or not csv_path.exists():
+        return 0
+    try:
+        legacy_df = pd.read_csv(
+            csv_path,
+            usecols=NEWS_COLUMNS,
+            dtype={"title": "string", "summary": "string", "url": "string", "sentiment": "float32"},
+            parse_dates=["time"],
+            date_format="ISO8601",
+            encoding='utf-8-sig',
+            engine="c",
+        )
+    except (IOError, ValueError) as e:
+        print(f"无法读取文件 {csv_path}: {e}")
+        return 0
+    legacy_df = legacy_df.dropna(subset=["time", "title", "summary", "url"]).drop_duplicates(subset=["url"], keep="last")
+    rows = legacy_df.astype(object).to_dict("records")
+    migrated_count = save_news(rows, filepath)
+    if filepath.exists():
+        # 保留旧文件的修改时间，避免迁移本身影响抓取间隔判断
+        csv_stat = csv_path.stat()
+        os.utime(filepath, (csv_stat.st_atime, csv_stat.st_mtime))
+    return migrated_count
+
 # --- 可被外部调用的主函数 ---
 def run_news_crawl():
+    migrate_csv_to_parquet()
     if DATA_FILE.exists():
         last_modified_time = datetime.fromtimestamp(DATA_FILE.stat().st_mtime)
         time_since_last_crawl = datetime.now() - last_modified_time
@@ -144,17 +262,17 @@ def run_news_crawl():
             return f"还没到4小时，请在 {hours} 小时 {minutes} 分钟后重试。", 0
     
     print("开始获取新数据...")
-    all_news = []
-    for keyword in KEYWORDS:
-        print(f"--- 正在处理关键词: {keyword} ---")
-        news = fetch_news(keyword, pages=2)
-        all_news.extend(news)
+    # 抓取是 I/O 密集型任务，所有 (关键词, 页码) 组合共享 SESSION 并发请求
+    tasks = [(kw, p) for kw in KEYWORDS for p in range(1, CRAWL_PAGES + 1)]
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as ex:
+        results = list(ex.map(lambda t: fetch_page(*t), tasks))
+    all_news = [item for page_news in results for item in page_news]
     
     if not all_news:
         return "未能抓取到任何新闻。", 0
 
     unique_news = list({item["url"]: item for item in all_news if item.get("url")}.values())
-    saved_count = save_news_to_csv(unique_news, DATA_FILE)
+    saved_count = save_news(unique_news, DATA_FILE)
     
     if saved_count > 0:
         return f"任务完成，成功获取 {saved_count} 条新新闻！", saved_count